@@ -2,91 +2,244 @@
 from typing import List
 import re
 import json
+import pickle
+import string
 from pathlib import Path
 from functools import lru_cache
+import streamlit as st
 from biochem_concepts import BIO_CONCEPTS
 
+# Robust imports (works whether you run as package or loose files)
+try:
+    from backend.question_loader import _LETTERS_LOWER, _QNUM_RE
+except Exception:
+    from question_loader import _LETTERS_LOWER, _QNUM_RE
+
 print("✅ concept_check.py loaded (v2025-11-xx qid+1 fix)")
 
+# Compiled once at import; these run on every student answer check
+_DIGIT_RE = re.compile(r"\d+(?:\.\d+)?")
+_ALPHA_RE = re.compile(r"[a-zA-Z]+")
+_LOWER_RE = re.compile(r"[a-z]+")
+_NONALNUM_RE = re.compile(r"[^a-z0-9]+")
+_WS_RE = re.compile(r"\s+")
+
 def normalize(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").lower().strip())
+    return _WS_RE.sub(" ", (s or "").lower().strip())
+
+# str.translate deletes in C without entering the regex engine; the table only
+# covers ASCII, so anything else falls back to _NONALNUM_RE
+_ALNUM = set(string.ascii_lowercase + string.digits)
+_ASCII_DROP_TBL = str.maketrans("", "", "".join(c for c in map(chr, range(128)) if c not in _ALNUM))
+
+def _alnum_only(s: str) -> str:
+    """Drop everything except a-z / 0-9 from lowercased text (NH3+ -> nh3)."""
+    if s.isascii():
+        return s.translate(_ASCII_DROP_TBL)
+    return _NONALNUM_RE.sub("", s)
+
+CHEM_TOKENS = frozenset({"cooh", "nh3", "nh2", "nterm", "cterm", "imidazole"})  # extend as needed
+
+# ---------- Concept index ----------
+# BIO_CONCEPTS never changes after import, so everything concept_hit derives
+# from a phrase is computed once here. Each entry is a parallel table:
+#   (stems_per_phrase, chem_tokens_per_phrase)
+
+def _chem_tokens_in(text: str) -> frozenset:
+    """CHEM_TOKENS present in lowercased text (normalized so NH3+ counts as 'nh3')."""
+    text_norm = _alnum_only(text)
+    return frozenset(t for t in CHEM_TOKENS if t in text_norm)
+
+def _phrase_features(phrase: str):
+    """(5-char stems of words > 4 chars, CHEM_TOKENS present) for one phrase."""
+    pl = (phrase or "").lower()
+    stems = frozenset(w[:5] for w in _LOWER_RE.findall(pl) if len(w) > 4)
+    return stems, _chem_tokens_in(pl)
+
+def _index_phrases(phrases: List[str]):
+    features = [_phrase_features(p) for p in phrases]
+    return tuple(stems for stems, _ in features), tuple(toks for _, toks in features)
+
+def _build_concept_index():
+    return {
+        (domain, concept): _index_phrases([p for p in [concept, *variants] if p])
+        for domain, concepts in BIO_CONCEPTS.items()
+        for concept, variants in concepts.items()
+    }
+
+_CONCEPT_INDEX = _build_concept_index()
+
+# Kept small on purpose: each entry holds ~len(answer) strings, and the key is
+# the growing answer history, so reuse only happens within one evaluate_concepts
+@lru_cache(maxsize=32)
+def _answer_stems(student: str) -> frozenset:
+    """
+    Every 5-char window of the lowercased answer. Stems are exactly 5 chars,
+    so `stem in student` is the same test as `stem in _answer_stems(student)`;
+    building the set once per answer turns each phrase check into set inclusion,
+    and every concept graded against the same answer shares it.
+    """
+    return frozenset(student[i:i + 5] for i in range(len(student) - 4))
+
+# domain -> concepts listed in BIO_CONCEPTS[domain] (variant list may be empty),
+# for an O(1) "anything to index?" check
+_DOMAIN_HAS = {domain: frozenset(concepts) for domain, concepts in BIO_CONCEPTS.items()}
+
+@lru_cache(maxsize=1024)
+def _concept_profile(concept: str):
+    """
+    Everything concept_hit needs from the concept string itself:
+    (numbers it requires, is-number-only, normalized text, has words > 4 chars,
+     its own stems, its own chemistry tokens).
+    """
+    nums = _DIGIT_RE.findall(concept) if any(ch.isdigit() for ch in (concept or "")) else []
+    numeric_only = bool(nums) and not _ALPHA_RE.search(concept)
+    norm_concept = normalize(concept)
+    has_long_words = any(len(w) > 4 for w in _ALPHA_RE.findall(norm_concept))
+    stems, toks = _phrase_features(concept)
+    return tuple(nums), numeric_only, norm_concept, has_long_words, stems, toks
 
 def concept_hit(concept: str, student_answer: str, domain: str | None = None) -> bool:
     """
     Returns True if the student's answer matches a concept,
     using the base phrase + any variants from BIO_CONCEPTS[domain].
     """
-    student = student_answer.lower()
+    # lowercase before caching so case-only differences share an entry
+    return _concept_hit_cached(concept, student_answer.lower(), domain)
+
+@lru_cache(maxsize=4096)
+def _concept_hit_cached(concept: str, student: str, domain: str | None) -> bool:
+    nums, numeric_only, norm_concept, has_long_words, stems, toks = _concept_profile(concept)
 
     # numeric concept support (e.g., "6.0", "9.2", "1.8")
-    if any(ch.isdigit() for ch in (concept or "")):
-        nums = re.findall(r"\d+(?:\.\d+)?", concept)
-        if nums:
-            # if any required number is missing, fail
-            if not all(n in student for n in nums):
-                return False
-
-            # ✅ if the concept is basically just a number (no letters), accept immediately
-            if not re.search(r"[a-zA-Z]", concept):
-                return True
+    if nums:
+        # if any required number is missing, fail
+        if not all(n in student for n in nums):
+            return False
 
-    # ✅ short-phrase support (e.g., "more than half", "net charge")
-    norm_concept = normalize(concept)
-    norm_student = normalize(student_answer)
+        # ✅ if the concept is basically just a number (no letters), accept immediately
+        if numeric_only:
+            return True
 
+    # ✅ short-phrase support (e.g., "more than half", "net charge")
     # If the concept is short / has no long words, allow direct phrase match
-    words = re.findall(r"[a-zA-Z]+", norm_concept)
-    long_words = [w for w in words if len(w) > 4]
-
-    if norm_concept and (norm_concept in norm_student) and (len(long_words) == 0):
+    if norm_concept and not has_long_words and norm_concept in normalize(student):
         return True
 
-    # collect all phrases to test: main concept + variants
-    phrases = [concept]
-    if domain and domain in BIO_CONCEPTS:
-        phrases.extend(BIO_CONCEPTS[domain].get(concept, []))
-
-    phrases = [p for p in phrases if p]
-    if not phrases:
-        return False
-
-    CHEM_TOKENS = {"cooh", "nh3", "nh2", "nterm", "cterm", "imidazole"}  # extend as needed
+    # Fast path: concept not listed in BIO_CONCEPTS[domain], so only its own
+    # stems / tokens can match and the index scan isn't needed
+    if concept not in _DOMAIN_HAS.get(domain, ()):
+        if stems and stems <= _answer_stems(student):
+            return True
+        return bool(toks) and toks <= _chem_tokens_in(student)
 
-    for phrase in phrases:
-        pl = phrase.lower()
+    # main concept + variants, pre-split into stems / chemistry tokens
+    stems_per_phrase, toks_per_phrase = _CONCEPT_INDEX[(domain, concept)]
+    student_stems = _answer_stems(student)
+    student_toks = None  # built on first phrase that has chemistry tokens
 
+    for stems, toks in zip(stems_per_phrase, toks_per_phrase):
         # 1) Original long-word stem match (unchanged behavior)
-        words = [w for w in re.findall(r"[a-z]+", pl) if len(w) > 4]
-        stems = [w[:5] for w in words]
-        long_ok = stems and all(stem in student for stem in stems)
+        if stems and stems <= student_stems:
+            return True
 
         # 2) NEW: short chemistry token match (only if present in the phrase)
-        # Normalize student so NH3+ matches as 'nh3'
-        student_norm = re.sub(r"[^a-z0-9]+", "", student)
-        phrase_norm = re.sub(r"[^a-z0-9]+", "", pl)
-
-        token_hits = []
-        for tok in CHEM_TOKENS:
-            if tok in phrase_norm:
-                token_hits.append(tok in student_norm)
-
-        short_ok = (len(token_hits) > 0) and all(token_hits)
-
-        if long_ok or short_ok:
-            return True
+        if toks:
+            if student_toks is None:
+                student_toks = _chem_tokens_in(student)
+            if toks <= student_toks:
+                return True
 
     return False
 
-@lru_cache(maxsize=16)
+# Parsed specs are pickled next to the JSON (<id>_answers.pkl) and reused while
+# the JSON's mtime is unchanged. Bump when the cached spec's shape changes.
+_SPEC_CACHE_VERSION = 4
+
+def _prepare_wrong_triggers(wrong_triggers: dict):
+    """
+    Compile a question's wrong_triggers into one alternation so grading does a
+    single search. Returns (pattern or None, {"t0": prompts, ...}, shortest
+    trigger length); the match's lastgroup names the trigger that fired.
+      numeric triggers keep a digit boundary ("1.8" won't fire inside "11.8")
+      text triggers are plain lowercased substrings
+    Triggers without any prompt text are dropped (they could never be used).
+    """
+    alts = []
+    prompts_by_name = {}
+    min_len = 0
+    for wrong_val, prompts in wrong_triggers.items():
+        wrong_s = str(wrong_val).strip()
+        if not wrong_s:
+            continue
+        if not ((isinstance(prompts, list) and prompts) or (isinstance(prompts, str) and prompts.strip())):
+            continue
+
+        name = f"t{len(alts)}"
+        if _DIGIT_RE.search(wrong_s):
+            alts.append(f"(?P<{name}>(?<!\\d){re.escape(wrong_s)}(?!\\d))")
+        else:
+            alts.append(f"(?P<{name}>{re.escape(wrong_s.lower())})")
+        prompts_by_name[name] = prompts
+        min_len = min(min_len, len(wrong_s)) if min_len else len(wrong_s)
+
+    pattern = re.compile("|".join(alts)) if alts else None
+    return pattern, prompts_by_name, min_len
+
+def _prepare_spec(spec_all: dict) -> dict:
+    """Adds load-time derived fields (prefixed "_") to each question spec."""
+    for spec in spec_all.values():
+        if not isinstance(spec, dict):
+            continue
+        wrong_triggers = spec.get("wrong_triggers", {}) or {}
+        if not isinstance(wrong_triggers, dict):
+            wrong_triggers = {}
+        (
+            spec["_wrong_trigger_re"],
+            spec["_wrong_trigger_prompts"],
+            spec["_wrong_trigger_minlen"],
+        ) = _prepare_wrong_triggers(wrong_triggers)
+    return spec_all
+
+def _read_spec_cache(cache_path: Path, mtime: int):
+    try:
+        with cache_path.open("rb") as f:
+            payload = pickle.load(f)
+        if payload.get("version") == _SPEC_CACHE_VERSION and payload.get("mtime") == mtime:
+            return payload["spec"]
+    except Exception:
+        pass
+    return None
+
+def _write_spec_cache(cache_path: Path, mtime: int, spec: dict) -> None:
+    try:
+        with cache_path.open("wb") as f:
+            pickle.dump({"version": _SPEC_CACHE_VERSION, "mtime": mtime, "spec": spec}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # read-only deploys just parse the JSON
+
+# cache_resource (not cache_data): callers share one parsed dict instead of
+# getting a fresh copy per rerun. Use load_concept_spec.clear() to reload.
+@st.cache_resource(ttl=24 * 60 * 60, show_spinner=False)
 def load_concept_spec(module_id: str):
     path = Path(f"modules/{module_id}/{module_id}_answers.json")
     print("📌 loading answers spec from:", path.resolve(), "exists:", path.exists())
     if not path.exists():
         return {}
-    return json.loads(path.read_text(encoding="utf-8"))
 
-def evaluate_concepts(module_id: str, qid: int, student_answer: str, part_idx: int = 0, stem: str | None = None):
+    mtime = path.stat().st_mtime_ns
+    cache_path = path.with_suffix(".pkl")
+    spec = _read_spec_cache(cache_path, mtime)
+    if spec is None:
+        spec = _prepare_spec(json.loads(path.read_text(encoding="utf-8")))
+        _write_spec_cache(cache_path, mtime, spec)
+    return spec
+
+def question_spec(module_id: str, qid: int, part_idx: int = 0, stem: str | None = None) -> dict:
     """
+    Returns the answers-JSON spec for one question part, or {} if there is none.
+
     qid is 0-based question index from pointer (0,1,2,...)
 
     If stem starts with an explicit question number like "21.", we use that number
@@ -98,7 +251,7 @@ def evaluate_concepts(module_id: str, qid: int, student_answer: str, part_idx: i
     # --- Prefer explicit question number from the stem ("21.", "21)", etc.) ---
     qnum_from_stem = None
     if stem:
-        m = re.match(r"\s*(\d+)\s*[\.\)]", stem.strip())
+        m = _QNUM_RE.match(stem.strip())
         if m:
             qnum_from_stem = int(m.group(1))
 
@@ -108,7 +261,7 @@ def evaluate_concepts(module_id: str, qid: int, student_answer: str, part_idx: i
     pi = int(part_idx or 0)
     if pi < 0:
         pi = 0
-    letter = chr(97 + pi)  # 0->a,1->b,...
+    letter = _LETTERS_LOWER[pi] if pi < len(_LETTERS_LOWER) else ""  # 0->a,1->b,...
 
     part_key = f"{qnum_str}{letter}"
     spec = spec_all.get(part_key)
@@ -116,6 +269,18 @@ def evaluate_concepts(module_id: str, qid: int, student_answer: str, part_idx: i
         spec = spec_all.get(qnum_str)
 
     if not isinstance(spec, dict):
+        return {}
+
+    print("🔎 looking for keys:", part_key, "or", qnum_str, "available:", list(spec_all.keys())[:15])
+    return spec
+
+def evaluate_concepts(module_id: str, qid: int, student_answer: str, part_idx: int = 0, stem: str | None = None):
+    """
+    Returns (missing_required, missing_optional, spec) for one question part.
+    See question_spec() for how qid / part_idx / stem pick the spec.
+    """
+    spec = question_spec(module_id, qid, part_idx=part_idx, stem=stem)
+    if not spec:
         return [], [], {}
 
     domain = spec.get("concept_domain")
@@ -124,30 +289,33 @@ def evaluate_concepts(module_id: str, qid: int, student_answer: str, part_idx: i
 
     missing_required = [c for c in required if not concept_hit(c, student_answer, domain)]
     missing_optional = [c for c in optional if not concept_hit(c, student_answer, domain)]
-    print("🔎 looking for keys:", part_key, "or", qnum_str, "available:", list(spec_all.keys())[:15])
 
     return missing_required, missing_optional, spec
 
+_UNSURE_PHRASES = [
+    "i don't know",
+    "idk",
+    "not sure",
+    "i am not sure",
+    "no idea",
+    "i'm unsure",
+    "unsure",
+    "i'm confused",
+    "i am confused"
+]
+# single alternation so the answer is scanned once, not once per phrase
+_UNSURE_RE = re.compile("|".join(re.escape(p) for p in _UNSURE_PHRASES))
+
+@lru_cache(maxsize=2048)
 def is_uncertain(text: str) -> bool:
     """
     Detects when a student expresses uncertainty.
     """
-    t = text.strip().lower()
-    unsure = [
-        "i don't know",
-        "idk",
-        "not sure",
-        "i am not sure",
-        "no idea",
-        "i'm unsure",
-        "unsure",
-        "i'm confused",
-        "i am confused"
-    ]
-    return any(u in t for u in unsure)
+    return bool(_UNSURE_RE.search(text.strip().lower()))
 
 _WORD = re.compile(r"[a-zA-Z]{2,}")
 
+@lru_cache(maxsize=2048)
 def is_gibberish(text: str) -> bool:
     """
     Heuristic: catches keyboard mashing / random strings.
@@ -165,18 +333,22 @@ def is_gibberish(text: str) -> bool:
     if is_uncertain(t):
         return False
 
+    # Lowercase once; the counts below are C-level passes (map / str.count)
+    # rather than per-character generator expressions
+    tl = t.lower()
+
     # Ratio of alphabetic characters
-    letters = sum(ch.isalpha() for ch in t)
+    letters = sum(map(str.isalpha, t))
     if letters / max(1, len(t)) < 0.5:
         return True
 
     # Tokenize into "words"
-    words = _WORD.findall(t.lower())
+    words = _WORD.findall(tl)
     if len(words) == 0:
         return True
 
     # Keyboard mash tends to be 1 long "word" with few vowels
-    vowels = sum(ch in "aeiou" for ch in t.lower())
+    vowels = sum(map(tl.count, "aeiou"))
     if len(t) >= 10 and vowels / max(1, letters) < 0.25:
         return True
 
@@ -1,15 +1,14 @@
 # backend/diagram_loader.py
 from __future__ import annotations
 
-import re
 from pathlib import Path
 from typing import Optional, Dict, Any
 
 # Robust imports (works whether you run as package or loose files)
 try:
-    from backend.question_loader import ModuleBundle, QuestionPointer
+    from backend.question_loader import ModuleBundle, QuestionPointer, _LETTERS_LOWER, _QNUM_RE
 except Exception:
-    from question_loader import ModuleBundle, QuestionPointer
+    from question_loader import ModuleBundle, QuestionPointer, _LETTERS_LOWER, _QNUM_RE
 
 
 def diagram_for_pointer(bundle: ModuleBundle, ptr: QuestionPointer) -> Optional[Dict[str, Any]]:
@@ -35,7 +34,7 @@ def diagram_for_pointer(bundle: ModuleBundle, ptr: QuestionPointer) -> Optional[
     except Exception:
         stem = ""
 
-    m = re.match(r"\s*(\d+)\s*[\.\)]", stem or "")
+    m = _QNUM_RE.match(stem or "")
     qnum = str(int(m.group(1))) if m else str(ptr.qi + 1)
 
     spec = bundle.diagrams.get(qnum)
@@ -48,7 +47,7 @@ def diagram_for_pointer(bundle: ModuleBundle, ptr: QuestionPointer) -> Optional[
         si = int(getattr(ptr, "si", 0) or 0)
         if si < 0:
             si = 0
-        part_letter = chr(97 + getattr(ptr, "si", 0))  # safe default
+        part_letter = _LETTERS_LOWER[si] if si < len(_LETTERS_LOWER) else None
         part_spec = parts.get(part_letter)
         if isinstance(part_spec, dict):
             merged = dict(spec)
@@ -59,31 +58,10 @@ def diagram_for_pointer(bundle: ModuleBundle, ptr: QuestionPointer) -> Optional[
     spec = dict(spec)  # 👈 copy immediately
     spec.setdefault("folder", "images")
 
-    # --- Normalize images into a dict like {"A":"file.png","B":"file.png","C":"file.png"} ---
-    imgs = spec.get("images")
-
-    # Case 1: already a dict (your current JSON)
-    if isinstance(imgs, dict):
-        spec["images"] = {str(k).upper(): v for k, v in imgs.items() if v}
-
-    # Case 2: list of dicts: [{"label":"A","file":"x.png"}, ...]
-    elif isinstance(imgs, list) and imgs and isinstance(imgs[0], dict):
-        out: Dict[str, str] = {}
-        for item in imgs:
-            label = str(item.get("label", "")).upper().strip()
-            filename = (item.get("file") or "").strip()
-            if label and filename:
-                out[label] = filename
-        spec["images"] = out
-
-    # Case 3: list of strings: ["a.png","b.png","c.png"] → auto-label A/B/C
-    elif isinstance(imgs, list) and imgs and isinstance(imgs[0], str):
-        letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        spec["images"] = {letters[i]: fn for i, fn in enumerate(imgs) if fn}
-
-    else:
-        # No usable images spec
-        spec["images"] = {}
+    # images were normalized to {"A":"file.png",...} (plus a label-sorted
+    # "_sorted_images" list) when the bundle loaded
+    spec.setdefault("images", {})
+    spec.setdefault("_sorted_images", [])
 
     return spec
 
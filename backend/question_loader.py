@@ -2,18 +2,20 @@
 from dataclasses import dataclass
 from pathlib import Path
 from functools import lru_cache
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import json
+import pickle
 import re
+import streamlit as st
 
-@dataclass
+@dataclass(slots=True)
 class QuestionPointer:
     """Pointer to specific question/subpart (0-based indices)."""
     qi: int  # question index
     si: int  # subpart index (0 if none)
     part: str | None = None  # NEW: "a", "b", "e", etc.
 
-@dataclass
+@dataclass(slots=True)
 class ModuleBundle:
     """All content for a module."""
     module_id: str
@@ -26,30 +28,27 @@ class ModuleBundle:
     # ---------- UI helpers ----------
     def question_text(self, ptr: QuestionPointer) -> str:
         q = self.questions[ptr.qi]
-        stem = (q.get("q") or "").strip()
-        parts = q.get("parts", []) or []
+        texts = q.get("_texts")
+        if texts is None:  # bundles not built by load_module_bundle
+            texts = _question_texts(q)
 
-        # If no subparts, just show the stem
-        if not parts:
-            return stem
-
-        # If subparts exist, show stem + current subpart
+        # One entry per subpart (just the stem if there are none);
+        # out-of-range subparts clamp to the first / last
         si = ptr.si if ptr.si is not None else 0
         if si < 0:
             si = 0
-        if si >= len(parts):
-            si = len(parts) - 1
-
-        part_text = (parts[si] or "").strip()
-        letter = chr(97 + si)  # 0->a, 1->b, ...
-
-        return f"{stem}\n\n{part_text}"
+        if si >= len(texts):
+            si = len(texts) - 1
+        return texts[si]
 
     def subparts_count(self, qi: int) -> int:
         if qi < 0 or qi >= len(self.questions):
             return 1
-        parts = self.questions[qi].get("parts", [])
-        return max(1, len(parts))
+        q = self.questions[qi]
+        texts = q.get("_texts")
+        if texts is not None:
+            return len(texts)
+        return max(1, len(q.get("parts", []) or []))
 
     def context_snips_for(self, ptr: QuestionPointer, k: int = 3) -> List[str]:
         """Short question-only snippets (never answers)."""
@@ -58,9 +57,9 @@ class ModuleBundle:
             idx = ptr.qi + off
             if 0 <= idx < len(self.questions):
                 q = self.questions[idx]
-                stem = q.get("q", "")
-                part0 = (q.get("parts") or [""])[0]
-                snippet = (stem + " " + part0).strip()[:160]
+                snippet = q.get("_snippet")
+                if snippet is None:  # bundles not built by load_module_bundle
+                    snippet = _question_snippet(q)
                 if snippet:
                     snips.append(snippet)
         return snips[:k]
@@ -89,6 +88,19 @@ class ModuleBundle:
             diagrams={}
         )
 
+def _question_texts(q: Dict[str, Any]) -> List[str]:
+    """Display text per subpart: stem + part, or just the stem if there are no parts."""
+    stem = (q.get("q") or "").strip()
+    parts = q.get("parts", []) or []
+    if not parts:
+        return [stem]
+    return [f"{stem}\n\n{(p or '').strip()}" for p in parts]
+
+def _question_snippet(q: Dict[str, Any]) -> str:
+    stem = q.get("q", "")
+    part0 = (q.get("parts") or [""])[0]
+    return (stem + " " + part0).strip()[:160]
+
 # ---- Load structured concept answers ----
 
 @lru_cache(maxsize=16)
@@ -104,19 +116,30 @@ def load_concept_keys(module_id: str):
 # ---------- Parsing & loading ----------
 
 def _read_lines(path: Path) -> List[str]:
+    """Non-empty, right-stripped lines, streamed rather than read whole."""
     if not path.exists():
         return []
-    return [ln.rstrip() for ln in path.read_text(encoding="utf-8").splitlines()]
+    with path.open(encoding="utf-8") as f:
+        return [s for ln in f if (s := ln.rstrip())]
+
+# Shared with diagram_loader / concept_check: part letters by subpart index
+# and the explicit "18." / "18)" number at the start of a question stem
+_LETTERS_LOWER = tuple("abcdefghijklmnopqrstuvwxyz")
+_LETTERS_UPPER = tuple("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_QNUM_RE = re.compile(r"\s*(\d+)\s*[\.\)]")
 
 _Q_LINE = re.compile(r"^\s*\d+\s*[\.\)]\s*")      # "1. " or "1) "
-_SUB_LINE = re.compile(r"^\s*[a-fA-F]\s*[\.\)]\s*")
+# one match per line tells question ("q") from subpart ("sub") headings
+_LINE_KIND_RE = re.compile(r"^\s*(?:(?P<q>\d+)|(?P<sub>[a-fA-F]))\s*[\.\)]\s*")
 _INLINE_PART_RE = re.compile(r"(?<!\w)([a-z])[\.\)]\s+", re.IGNORECASE)
 
-def _split_inline_parts(text: str):
+def _split_inline_parts(text: str, prefix_letters: bool = False):
     """
     Split a single line that contains inline parts like:
       '... a. ... b. ... c. ...'
     Returns: (stem_text, parts_list) where parts_list is [{"id":"a","text":"..."}, ...]
+    With prefix_letters=True, parts_list is ["a) ...", "b) ...", ...] instead,
+    the same style the parser uses for subpart lines.
     If no inline parts found, returns (text, []).
     """
     s = (text or "").strip()
@@ -135,7 +158,10 @@ def _split_inline_parts(text: str):
         end = matches[i + 1].start() if i + 1 < len(matches) else len(s)
         part_text = s[start:end].strip(" \t-:;")
         if part_text:
-            parts.append({"id": letter, "text": part_text})
+            if prefix_letters:
+                parts.append(f"{letter}) {part_text}")
+            else:
+                parts.append({"id": letter, "text": part_text})
 
     return stem, parts
 
@@ -152,40 +178,6 @@ def _parse_qa_lines(lines: List[str]) -> List[Dict[str, Any]]:
     out: List[Dict[str, Any]] = []
     cur: Optional[Dict[str, Any]] = None
 
-    # Inline-part splitter: finds "a." / "b)" etc *inside* a line
-    _INLINE_PART_RE = re.compile(r"(?<!\w)([a-z])[\.\)]\s+", re.IGNORECASE)
-
-    def _split_inline_parts(text: str):
-        """
-        If text contains inline 'a. ... b. ...', return (stem, [part1, part2, ...])
-        where each part is stored as a normal subpart line like "a) ...".
-        If none found, return (text, []).
-        """
-        s = (text or "").strip()
-        matches = list(_INLINE_PART_RE.finditer(s))
-        if not matches:
-            return s, []
-
-        stem = s[: matches[0].start()].strip()
-
-        parts: List[str] = []
-        for i, m in enumerate(matches):
-            letter = m.group(1).lower()
-            start = m.end()
-            end = matches[i + 1].start() if i + 1 < len(matches) else len(s)
-            body = s[start:end].strip(" \t-:;")
-            if body:
-                # store in the same style your parser already expects for subparts
-                parts.append(f"{letter}) {body}")
-
-        return stem, parts
-
-    def is_q(line: str) -> bool:
-        return bool(_Q_LINE.match(line))
-
-    def is_sub(line: str) -> bool:
-        return bool(_SUB_LINE.match(line))
-
     started = False
 
     for raw in lines:
@@ -193,13 +185,16 @@ def _parse_qa_lines(lines: List[str]) -> List[Dict[str, Any]]:
         if not line:
             continue
 
-        if is_q(line):
+        m = _LINE_KIND_RE.match(line)
+        kind = m.lastgroup if m else None
+
+        if kind == "q":
             started = True
             if cur:
                 out.append(cur)
 
             # ✅ NEW: split inline a/b/c... if they exist in the question line
-            stem, inline_parts = _split_inline_parts(line)
+            stem, inline_parts = _split_inline_parts(line, prefix_letters=True)
             cur = {"q": stem, "parts": []}
             if inline_parts:
                 cur["parts"].extend(inline_parts)
@@ -209,7 +204,7 @@ def _parse_qa_lines(lines: List[str]) -> List[Dict[str, Any]]:
         if not started:
             continue
 
-        if cur and is_sub(line):
+        if cur and kind == "sub":
             cur["parts"].append(line)
         elif cur:
             # continuation
@@ -251,7 +246,104 @@ def _group_answers(answer_lines: List[str], q_count: int) -> List[List[str]]:
         groups = groups[:q_count]
     return groups
 
-@lru_cache(maxsize=32)
+# ---------- Diagram specs ----------
+
+def _normalize_images(imgs: Any) -> Dict[str, str]:
+    """Normalize an images spec into a dict like {"A":"file.png","B":"file.png","C":"file.png"}."""
+    # Case 1: already a dict (your current JSON)
+    if isinstance(imgs, dict):
+        return {str(k).upper(): v for k, v in imgs.items() if v}
+
+    # Case 2: list of dicts: [{"label":"A","file":"x.png"}, ...]
+    if isinstance(imgs, list) and imgs and isinstance(imgs[0], dict):
+        out: Dict[str, str] = {}
+        for item in imgs:
+            label = str(item.get("label", "")).upper().strip()
+            filename = (item.get("file") or "").strip()
+            if label and filename:
+                out[label] = filename
+        return out
+
+    # Case 3: list of strings: ["a.png","b.png","c.png"] → auto-label A/B/C
+    if isinstance(imgs, list) and imgs and isinstance(imgs[0], str):
+        return {_LETTERS_UPPER[i]: fn for i, fn in enumerate(imgs) if fn}
+
+    # No usable images spec
+    return {}
+
+def _normalize_diagrams(diagrams: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize every question's (and subpart's) "images" once at load time,
+    so diagram_for_pointer only has to merge parent + part specs per render.
+    Specs without "images" are left alone so parts still inherit the parent's.
+    """
+    for spec in diagrams.values():
+        if not isinstance(spec, dict):
+            continue  # e.g. "bonus_question"
+        specs = [spec]
+        parts = spec.get("parts")
+        if isinstance(parts, dict):
+            specs.extend(p for p in parts.values() if isinstance(p, dict))
+        for sp in specs:
+            if "images" in sp:
+                sp["images"] = _normalize_images(sp["images"])
+                sp["_sorted_images"] = sorted(sp["images"].items())  # render order
+    return diagrams
+
+# ---------- Bundle cache ----------
+# Parsed bundles are cached in st.cache_resource (one shared object for every
+# session) and on disk (modules/<id>/.cache.pkl), both keyed on the source
+# files' mtimes so edits are picked up without a restart.
+# Bump _BUNDLE_CACHE_VERSION whenever ModuleBundle's shape changes.
+
+_BUNDLE_CACHE_VERSION = 5
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+def _read_bundle_cache(cache_file: Path, stamp: tuple) -> Optional[ModuleBundle]:
+    try:
+        with cache_file.open("rb") as f:
+            payload = pickle.load(f)
+        if payload.get("version") != _BUNDLE_CACHE_VERSION or payload.get("stamp") != stamp:
+            return None
+        return ModuleBundle(**payload["fields"])
+    except Exception:
+        return None
+
+def _write_bundle_cache(cache_file: Path, stamp: tuple, bundle: ModuleBundle) -> None:
+    # store plain fields so the pickle doesn't depend on how this module was imported
+    payload = {
+        "version": _BUNDLE_CACHE_VERSION,
+        "stamp": stamp,
+        "fields": {
+            "module_id": bundle.module_id,
+            "title": bundle.title,
+            "questions": bundle.questions,
+            "answers": bundle.answers,
+            "notes": bundle.notes,
+            "diagrams": bundle.diagrams,
+        },
+    }
+    try:
+        with cache_file.open("wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # read-only deploys just skip the disk cache
+
+def _module_files(module_id: str) -> Tuple[Path, Path, Path, Path, Path]:
+    mdir = Path("modules") / module_id
+    return (
+        mdir / f"{module_id}_questions.txt",
+        mdir / f"{module_id}_answers.txt",
+        mdir / f"{module_id}_notes.txt",
+        mdir / f"{module_id}_diagrams.json",
+        mdir / "title.txt",  # optional nice title
+    )
+
 def load_module_bundle(module_id: str) -> ModuleBundle:
     """
     Load using your naming convention:
@@ -260,32 +352,50 @@ def load_module_bundle(module_id: str) -> ModuleBundle:
       modules/<id>/<id>_notes.txt       (optional)
       modules/<id>/<id>_diagrams.json   (optional)
       modules/<id>/images or diagrams/  (optional assets)
+
+    Re-parses only when one of those files changes (see bundle cache above).
+    The returned bundle is shared across sessions: treat it as read-only and
+    keep per-session position in TutorState.ptr.
     """
     mdir = Path("modules") / module_id
     if not mdir.exists():
         raise FileNotFoundError(f"Module folder not found: {mdir}")
 
-    q_file = mdir / f"{module_id}_questions.txt"
-    a_file = mdir / f"{module_id}_answers.txt"
-    n_file = mdir / f"{module_id}_notes.txt"
-    d_file = mdir / f"{module_id}_diagrams.json"
-    t_file = mdir / "title.txt"  # optional nice title
-
-    q_lines = [ln for ln in _read_lines(q_file) if ln.strip()]
+    stamp = tuple(_mtime(p) for p in _module_files(module_id))
+    return _load_bundle(module_id, stamp)
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _load_bundle(module_id: str, stamp: tuple) -> ModuleBundle:
+    cache_file = Path("modules") / module_id / ".cache.pkl"
+    bundle = _read_bundle_cache(cache_file, stamp)
+    if bundle is None:
+        bundle = _parse_module_bundle(module_id, *_module_files(module_id))
+        _write_bundle_cache(cache_file, stamp, bundle)
+    return bundle
+
+def _parse_module_bundle(
+    module_id: str, q_file: Path, a_file: Path, n_file: Path, d_file: Path, t_file: Path
+) -> ModuleBundle:
+    q_lines = _read_lines(q_file)
     if not q_lines:
         raise ValueError(f"No questions found in {q_file.name}")
     questions = _parse_qa_lines(q_lines)
+    for q in questions:
+        q["_snippet"] = _question_snippet(q)  # static; built once for context_snips_for
+        q["_texts"] = _question_texts(q)      # ditto for question_text / subparts_count
 
-    a_lines = [ln for ln in _read_lines(a_file) if ln.strip()]
+    a_lines = _read_lines(a_file)
     answers = _group_answers(a_lines, len(questions))
 
-    notes = [ln for ln in _read_lines(n_file) if ln.strip()]
+    notes = _read_lines(n_file)
     diagrams: Dict[str, Any] = {}
     if d_file.exists():
         try:
             diagrams = json.loads(d_file.read_text(encoding="utf-8"))
         except Exception:
             diagrams = {}
+    if isinstance(diagrams, dict):
+        diagrams = _normalize_diagrams(diagrams)
 
     title = t_file.read_text(encoding="utf-8").strip() if t_file.exists() else module_id
 
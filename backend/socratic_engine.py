@@ -9,16 +9,34 @@ Returns:
   - None if all required concepts are covered (so UI can advance)
 """
 from typing import List
-import re
-import random
+import inspect
 import streamlit as st
-from concept_check import evaluate_concepts, is_uncertain, is_gibberish
-from biochem_concepts import BIO_CONCEPTS
+
+# Robust imports (works whether you run as package or loose files); the app
+# imports backend.concept_check, so prefer it to share one set of caches
+try:
+    from backend.concept_check import evaluate_concepts, is_uncertain, is_gibberish
+except Exception:
+    from concept_check import evaluate_concepts, is_uncertain, is_gibberish
+
+# Older concept_check.evaluate_concepts had no part_idx/stem; check once here
+# instead of catching TypeError on every submit
+_EC_HAS_PART = "part_idx" in inspect.signature(evaluate_concepts).parameters
 
 # ---------------------------------------------------------
 # 🔍Smart semantic matching for key concepts
 # ---------------------------------------------------------
 
+def _next_variant(key: tuple, n: int) -> int:
+    """
+    Rotating index into a list of n phrasings, kept per key in session_state,
+    so repeated follow-ups cycle through every variant instead of repeating.
+    """
+    rot = st.session_state.setdefault("_rot", {})
+    i = rot.get(key, 0) % n
+    rot[key] = i + 1
+    return i
+
 def uncertainty_message(spec: dict) -> str:
     follow = (spec or {}).get(
         "uncertainty_followup",
@@ -51,10 +69,14 @@ def socratic_followup(
 ):
     text = (student_answer or "").strip()
 
+    # 0) Nothing to grade yet: skip the concept-matching pass entirely
+    if not text and not (uncertain_now or gibberish_now):
+        return "Nice start — can you add one more molecular detail?"
+
     # 1) Pull concept spec + missing concepts
     # ✅ qid stays 0-based here.
     # ✅ part_idx is passed if concept_check supports it; otherwise we fall back cleanly.
-    try:
+    if _EC_HAS_PART:
         missing_required, _missing_optional, spec = evaluate_concepts(
             module_id,
             qid,
@@ -62,7 +84,7 @@ def socratic_followup(
             part_idx=part_idx,
             stem=stem,
         )
-    except TypeError:
+    else:
         # Older concept_check.evaluate_concepts signature (no part_idx)
         missing_required, _missing_optional, spec = evaluate_concepts(module_id, qid, text)
 
@@ -91,37 +113,32 @@ def socratic_followup(
     # If they used a known wrong numeric answer, ask the targeted follow-up.
     # Only run this if we *still* have missing required concepts.
     latest = (latest_answer or "").lower().strip()
-    wrong_triggers = spec.get("wrong_triggers", {}) or {}
-    if missing_required and isinstance(wrong_triggers, dict):
-        for wrong_val, prompts in wrong_triggers.items():
-            wrong_s = str(wrong_val).strip()
-            if not wrong_s:
-                continue
-
-            # numeric triggers: keep the digit-boundary guard
-            if re.search(r"\d", wrong_s):
-                hit = re.search(rf"(?<!\d){re.escape(wrong_s)}(?!\d)", latest)
+    # (all triggers are compiled into one alternation when the spec loads;
+    # skip the search when the answer is empty or shorter than every trigger)
+    trigger_re = spec.get("_wrong_trigger_re")
+    if (
+        missing_required
+        and trigger_re is not None
+        and latest
+        and len(latest) >= spec.get("_wrong_trigger_minlen", 0)
+    ):
+        m = trigger_re.search(latest)
+        if m:
+            # pick a follow-up prompt tied to that wrong value
+            prompts = spec["_wrong_trigger_prompts"][m.lastgroup]
+            if isinstance(prompts, list):
+                follow_text = prompts[_next_variant(("wrong", module_id, qid, part_idx, m.lastgroup), len(prompts))]
             else:
-                # text triggers: simple substring is best
-                hit = wrong_s.lower() in latest
-
-            if hit:
-                # pick a follow-up prompt tied to that wrong value
-                if isinstance(prompts, list) and prompts:
-                    follow_text = random.choice(prompts)
-                elif isinstance(prompts, str) and prompts.strip():
-                    follow_text = prompts.strip()
-                else:
-                    follow_text = ""
-
-                if follow_text:
-                    encouragement_list = spec.get("encouragement", []) or []
-                    encouragement = (
-                        random.choice(encouragement_list)
-                        if encouragement_list
-                        else "Keep going — you're on the right track."
-                    )
-                    return f"{encouragement} {follow_text}"
+                follow_text = prompts.strip()
+
+            if follow_text:
+                encouragement_list = spec.get("encouragement", []) or []
+                encouragement = (
+                    encouragement_list[_next_variant(("enc", module_id, qid, part_idx), len(encouragement_list))]
+                    if encouragement_list
+                    else "Keep going — you're on the right track."
+                )
+                return f"{encouragement} {follow_text}"
 
     # 5) If all REQUIRED concepts covered → advance
     if not missing_required:
@@ -130,13 +147,21 @@ def socratic_followup(
     # 6) Ask targeted followup
     concept = missing_required[0]
     encouragement_list = spec.get("encouragement", []) or []
-    encouragement = random.choice(encouragement_list) if encouragement_list else "Keep going — you're on the right track."
+    encouragement = (
+        encouragement_list[_next_variant(("enc", module_id, qid, part_idx), len(encouragement_list))]
+        if encouragement_list
+        else "Keep going — you're on the right track."
+    )
 
     followups_map = spec.get("followups", {}) or {}
     follow_entry = followups_map.get(concept)
 
     if isinstance(follow_entry, list):
-        follow_text = random.choice(follow_entry) if follow_entry else ""
+        follow_text = (
+            follow_entry[_next_variant(("follow", module_id, qid, part_idx, concept), len(follow_entry))]
+            if follow_entry
+            else ""
+        )
     else:
         follow_text = follow_entry or ""
 
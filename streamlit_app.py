@@ -1,22 +1,30 @@
 import streamlit as st
+from collections import deque
+from itertools import starmap
 from pathlib import Path
+import html
 import sys
 
 # ✅ Ensure backend is importable in Streamlit Cloud
 sys.path.append(str(Path(__file__).parent))
 sys.path.append(str(Path(__file__).parent / "backend"))
 
-# backend imports
+# backend imports: only what the Start flow needs; grading and diagram modules
+# are imported where they are first used so the first paint doesn't wait on them
 from backend.tutor_state import TutorState
 from backend.question_loader import load_module_bundle, next_pointer, QuestionPointer
-from backend.diagram_loader import diagram_for_pointer, diagram_image_path
-
-from backend.socratic_engine import socratic_followup
-from backend.concept_check import is_uncertain, is_gibberish, load_concept_spec
-load_concept_spec.cache_clear()
 
 #from backend.hf_model import init_hf, hf_socratic
 
+# chat history cap: older bubbles drop off so render + session_state stay bounded
+MAX_CHAT_MESSAGES = 200
+
+# messages are (css_class, html) tuples: "student" / "tutor" name both the
+# speaker and the bubble class. Bubbles render with unsafe_allow_html, so any
+# user-supplied text (answers, the student's name in tutor messages) must go
+# through html.escape when the message is appended.
+_bubble_html = "<div class='chat-bubble {}'>{}</div>".format
+
 
 # ---------- PAGE CONFIG ----------
 st.set_page_config(
@@ -62,16 +70,32 @@ st.markdown("""
     #st.session_state.llm = init_hf()
 
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _list_modules(root: str) -> list[str]:
+    # module folders only change on deploy; avoid an iterdir + stat per rerun
+    return sorted(p.name for p in Path(root).iterdir() if p.is_dir())
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _image_bytes(path: str) -> bytes:
+    # diagram images are static; read each once instead of on every rerun
+    return Path(path).read_bytes()
+
+
 # ---------- SIDEBAR: name + module ----------
 st.sidebar.title("🧬 BC351 Learning Assistant")
 
 student_name = st.sidebar.text_input("Your name")
-modules_dir = Path("modules")
-module_ids = sorted([p.name for p in modules_dir.iterdir() if p.is_dir()])
+module_ids = _list_modules("modules")
 module_id = st.sidebar.selectbox("Module", module_ids or ["(no modules)"])
 
 start_clicked = st.sidebar.button("Start / Restart", type="primary")
 
+# answer specs are cached across reruns; reload after editing *_answers.json
+if st.sidebar.button("Reload specs"):
+    from backend.concept_check import load_concept_spec
+    load_concept_spec.clear()
+
 st.sidebar.markdown("---")
 st.sidebar.info("Tip: Your answers aren’t graded — the tutor helps you think deeper.")
 
@@ -89,11 +113,11 @@ if "state" not in st.session_state or start_clicked:
     try:
         bundle = load_module_bundle(module_id)
         st.session_state.state.bundle = bundle
-        st.session_state.messages = [
-            ("tutor", f"Welcome, {student_name}! 👋 You selected **{module_id}**."),
+        st.session_state.messages = deque([
+            ("tutor", f"Welcome, {html.escape(student_name)}! 👋 You selected **{module_id}**."),
             ("tutor", "First question:"),
             ("tutor", st.session_state.state.current_question_text())
-        ]
+        ], maxlen=MAX_CHAT_MESSAGES)
     except Exception as e:
         st.error(f"Error loading module: {e}")
         st.stop()
@@ -103,13 +127,22 @@ if "state" not in st.session_state or start_clicked:
 
 state: TutorState = st.session_state.state
 
-# ---------- LAYOUT ----------
-left, right = st.columns([1.5, 1])
+# widget keys, unique per question *and subpart*
+# (qi = question index, si = subpart index; si can be None)
+si = state.ptr.si if state.ptr.si is not None else 0
+qkey = f"{module_id}_{state.ptr.qi}_{si}"
+choice_key = f"diag_choice_{qkey}"
+form_key = f"diag_form_{qkey}"
+
+# ----- get diagram spec for this question (if any); shared by both panels -----
+from backend.diagram_loader import diagram_for_pointer, diagram_image_path
 
-# ----- get diagram spec for this question (if any) -----
 diag = diagram_for_pointer(state.bundle, state.ptr)
 is_diag_mcq = isinstance(diag, dict) and diag.get("type") == "mcq"
 
+# ---------- LAYOUT ----------
+left, right = st.columns([1.5, 1])
+
 with left:
     st.subheader("Session")
 
@@ -120,13 +153,6 @@ with left:
         if prompt:
             st.write(prompt)
 
-        # unique per question *and subpart*
-        # (qi = question index, si = subpart index; si can be None)
-        si = state.ptr.si if state.ptr.si is not None else 0
-        qkey = f"{module_id}_{state.ptr.qi}_{si}"
-        choice_key = f"diag_choice_{qkey}"
-        form_key = f"diag_form_{qkey}"
-
         images_dict = diag.get("images") or {}
         options = list(images_dict.keys())  # ["A","B","C"]
 
@@ -168,15 +194,13 @@ with left:
         choice = None
 
     # ---------- CHAT DISPLAY ----------
-    for role, msg in st.session_state.messages:
-        bubble_class = "student" if role == "student" else "tutor"
-        st.markdown(f"<div class='chat-bubble {bubble_class}'>{msg}</div>", unsafe_allow_html=True)
+    # One markdown element for the whole transcript instead of one per bubble.
+    # Blank-line separators keep each bubble its own HTML block, as before.
+    chat_html = "\n\n".join(starmap(_bubble_html, st.session_state.messages))
+    st.markdown(chat_html, unsafe_allow_html=True)
 
 # ---------- Handle DIAGRAM SUBMIT ----------
 if submit_diag:
-    si = state.ptr.si if state.ptr.si is not None else 0
-    qkey = f"{module_id}_{state.ptr.qi}_{si}"
-    choice_key = f"diag_choice_{qkey}"
     picked = st.session_state.get(choice_key)
 
     st.session_state.messages.append(("student", f"[Diagram choice: {picked}]"))
@@ -207,40 +231,39 @@ if submit_diag:
     st.rerun()
 
 # ---------- Handle SUBMIT ----------
-if submit and ans.strip():
+latest = ans.strip()  # stripped once; reused for logging, classifiers and history
+if submit and latest:
+    from backend.socratic_engine import socratic_followup
+    from backend.concept_check import is_uncertain, is_gibberish
+
     # 1️⃣ Log this answer in the chat
-    st.session_state.messages.append(("student", ans.strip()))
+    st.session_state.messages.append(("student", html.escape(latest)))
 
     # 2️⃣ Uncertainty tracking should use ONLY the latest submission
-    uncertain_now = is_uncertain(ans.strip())
-    gibberish_now = is_gibberish(ans.strip())
-
-    # Track uncertainty count per (module, question)
-    ukey = (module_id, state.ptr.qi)  # qid is 0-based
-    if "uncertain_counts" not in st.session_state:
-        st.session_state.uncertain_counts = {}
-    if "gibberish_counts" not in st.session_state:
-        st.session_state.gibberish_counts = {}
-
-    prior_uncertain_count = st.session_state.uncertain_counts.get(ukey, 0)
-    prior_gibberish_count = st.session_state.gibberish_counts.get(ukey, 0)
+    uncertain_now = is_uncertain(latest)
+    gibberish_now = is_gibberish(latest)
+
+    # One record per (module, question): uncertainty / gibberish counts + answer history
+    rec = st.session_state.setdefault("qrec", {}).setdefault(
+        (module_id, state.ptr.qi),  # qid is 0-based
+        {"unc": 0, "gib": 0, "hist": ""},
+    )
+
+    prior_uncertain_count = rec["unc"]
+    prior_gibberish_count = rec["gib"]
     if uncertain_now:
-        st.session_state.uncertain_counts[ukey] = prior_uncertain_count + 1
+        rec["unc"] += 1
     if gibberish_now:
-        st.session_state.gibberish_counts[ukey] = prior_gibberish_count + 1
+        rec["gib"] += 1
 
     # 3️⃣ Accumulate answer history for THIS question (but DO NOT store uncertainty answers)
-    key = (module_id, state.ptr.qi)
-    if "answer_history" not in st.session_state:
-        st.session_state.answer_history = {}
-
-    prev = st.session_state.answer_history.get(key, "")
+    prev = rec["hist"]
 
     if uncertain_now:
         combined = prev  # keep prior real content only
     else:
-        combined = (prev + " " + ans.strip()).strip()
-        st.session_state.answer_history[key] = combined
+        combined = (prev + " " + latest).strip()
+        rec["hist"] = combined
 
     # 4️⃣ Ask ONE concept-based Socratic follow-up using combined history
     follow = socratic_followup(
@@ -249,7 +272,7 @@ if submit and ans.strip():
         combined,
         part_idx=state.ptr.si,
         stem=(state.bundle.questions[state.ptr.qi].get("q") or ""),
-        latest_answer=ans.strip(),
+        latest_answer=latest,
         uncertain_now=uncertain_now,
         uncertain_count=prior_uncertain_count,  # count BEFORE this submission
         gibberish_now=gibberish_now,
@@ -289,23 +312,21 @@ if skip:
 # ---------- RIGHT PANEL ----------
 with right:
     st.subheader("Diagram / Info")
-    diag = diagram_for_pointer(state.bundle, state.ptr)
 
     if isinstance(diag, dict):
         if diag.get("type") == "mcq" and isinstance(diag.get("images"), dict):
-            imgs = diag["images"]  # {"A":"...", "B":"...", "C":"..."}
-
-            for label, filename in sorted(imgs.items()):
+            # [("A","..."), ("B","..."), ("C","...")], pre-sorted at bundle load
+            for label, filename in diag["_sorted_images"]:
                 st.markdown(f"**{label}**")
                 st.image(
-                    diagram_image_path(module_id, diag, filename),
+                    _image_bytes(diagram_image_path(module_id, diag, filename)),
                     use_column_width=True
                 )
         else:
             # single-image legacy support
             img = diag.get("image")
             if img:
-                st.image(diagram_image_path(module_id, diag, img))
+                st.image(_image_bytes(diagram_image_path(module_id, diag, img)))
 
         prompt = (diag.get("prompt") or "").strip()
         if prompt: